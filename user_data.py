@@ -4,94 +4,178 @@ import os
 import sys
 import json
 import time
+import pathlib
+import socket
+import concurrent.futures
+import urllib.parse
 import urllib.request
-import urllib.error
+import shutil
 import subprocess
-import datetime
-import base64
-import argparse
-
-# Set up argument parser
-parser = argparse.ArgumentParser(description='EC2 User Data Script')
-parser.add_argument('--instance-name', required=True, help='Name of the EC2 instance')
-parser.add_argument('--environment', required=True, help='Environment tag')
-parser.add_argument('--scripts-repository-url', required=False, default='', help='URL to scripts repository')
-parser.add_argument('--script-aliases', required=False, default='', help='Space-separated list of script aliases')
-parser.add_argument('--script-parameters', required=False, default='{}', help='JSON map of script parameters')
-parser.add_argument('--webhook-url', required=False, default='', help='Webhook URL for notifications')
-parser.add_argument('--init-script', required=False, default='', help='Custom initialization script')
-
-# Parse arguments
-args = parser.parse_args()
-
-# Set up logging to append to the same file
-log_file = open('/var/log/user-data.log', 'a')
-sys.stdout = log_file
-sys.stderr = log_file
-
-print("\n\n===== PYTHON SCRIPT STARTED =====\n")
-
-def run_command(command, shell=True):
-    """Run a shell command and return output and exit code"""
+
+import urllib3
+
+# Serialize straight to bytes with orjson when available, compact json otherwise
+try:
+    import orjson
+    _dumps = orjson.dumps
+except ImportError:
+    def _dumps(obj):
+        return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+def run_command(command, shell=True, capture=True):
+    """Run a shell command and return output and exit code (output goes to the log when capture is False)"""
+    stream = subprocess.PIPE if capture else None
     try:
         result = subprocess.run(
             command,
             shell=shell,
             check=False,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            universal_newlines=True
+            stdout=stream,
+            stderr=stream,
+            text=capture
         )
-        return result.stdout, result.stderr, result.returncode
+        return result.stdout or "", result.stderr or "", result.returncode
     except Exception as e:
         return "", str(e), 1
 
-# Update system
-print("Updating system...")
-run_command("apt-get -qq update -y")
-
-# Install required packages
-print("Installing required packages...")
-run_command("apt-get -qq install -y openssh-client curl wget jq")
-print("Package installation completed")
-
-# Verify jq is installed
-stdout, stderr, exit_code = run_command("which jq")
-if exit_code != 0:
-    print("jq not installed, trying again...")
-    run_command("apt-get install -y jq")
-    stdout, stderr, exit_code = run_command("which jq")
-    if exit_code != 0:
-        print("ERROR: Failed to install jq. Exiting.")
-        sys.exit(1)
+def utcnow_iso():
+    """Return the current UTC time as an ISO 8601 timestamp"""
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+
+def worker_count(task_count):
+    """Size an I/O-bound thread pool from the CPUs this process may run on"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 2
+    return max(2, min(task_count, cpus * 4, 16))
+
+def _exec_opener(path, flags):
+    """Opener that creates files executable up front, avoiding a separate chmod"""
+    return os.open(path, flags | os.O_CREAT | os.O_WRONLY | os.O_TRUNC, 0o755)
 
-print("jq is installed and available")
+def head_lines(text, count=20):
+    """Return the first count lines of text, keeping line endings"""
+    end = -1
+    for _ in range(count):
+        end = text.find("\n", end + 1)
+        if end == -1:
+            return text
+    return text[:end + 1]
 
-# Initialize status report
-timestamp = datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
-instance_name = args.instance_name
-script_status_report = {
-    "timestamp": timestamp,
-    "instance_name": instance_name,
-    "scripts": {}
+# Shared connection pools so repeated requests to the same host reuse sockets.
+# Retries are budgeted per kind so redirects get the same allowance as urlopen.
+_POOL_OPTIONS = dict(
+    num_pools=4,
+    maxsize=16,
+    retries=urllib3.Retry(connect=2, read=2, redirect=10),
+    timeout=urllib3.Timeout(connect=2.0, read=10.0)
+)
+_http = urllib3.PoolManager(**_POOL_OPTIONS)
+
+# Honour http_proxy/https_proxy/no_proxy like urlopen did, with one proxy pool per scheme
+_proxy_pools = {
+    scheme: urllib3.ProxyManager(proxy if "://" in proxy else f"http://{proxy}", **_POOL_OPTIONS)
+    for scheme, proxy in urllib.request.getproxies().items()
+    if scheme in ("http", "https")
 }
 
+IMDS_HOST = "169.254.169.254"
+
+def _pool_for(url):
+    """Pick the proxy pool for a URL's scheme, or the direct pool when it isn't proxied"""
+    parsed = urllib.parse.urlsplit(url)
+    proxy_pool = _proxy_pools.get(parsed.scheme)
+    # IMDS is link-local and must never be reached through a proxy
+    if proxy_pool is None or parsed.hostname == IMDS_HOST or urllib.request.proxy_bypass(parsed.netloc):
+        return _http
+    return proxy_pool
+
+def http_request(method, url, **kwargs):
+    """Issue a request through the shared pools, raising on HTTP error status"""
+    response = _pool_for(url).request(method, url, **kwargs)
+    if response.status >= 400:
+        response.drain_conn()
+        raise urllib3.exceptions.HTTPError(f"HTTP Error {response.status}: {response.reason}")
+    return response
+
+def open_url(url):
+    """Open a URL for streaming reads: http(s) through the shared pools, other schemes (e.g. file://) through urllib"""
+    if urllib.parse.urlsplit(url).scheme in ("http", "https"):
+        return http_request("GET", url, preload_content=False)
+    return urllib.request.urlopen(url, timeout=10.0)
+
+# IMDS is link-local; fail fast instead of inheriting the download timeouts
+IMDS_TIMEOUT = urllib3.Timeout(connect=0.5, read=1.0)
+IMDS_RETRIES = urllib3.Retry(total=2, backoff_factor=0.1)
+
+# A slow webhook must not hang the rest of the boot
+WEBHOOK_TIMEOUT = urllib3.Timeout(connect=2.0, read=10.0)
+
+# Working directory for the repository file, downloaded scripts and their output
+SCRIPTS_DIR = pathlib.Path("/tmp/scripts")
+
+def script_path(alias, suffix):
+    """Return the path of a per-alias file, keeping the alias from escaping SCRIPTS_DIR"""
+    return SCRIPTS_DIR / f"{alias.replace('/', '_')}{suffix}"
+
+# Run state shared with the helpers below; main() fills in the report header
+# and opens the status log, but the helpers also work without it
+script_status_report = {"scripts": {}}
+status_log = None
+
+def record_script_status(alias, status):
+    """Store a script's status in the report and append it to the status log"""
+    script_status_report["scripts"][alias] = status
+    if status_log is None:
+        return
+    
+    # One self-describing line per script; a log failure must not abort the run
+    line = {
+        "timestamp": utcnow_iso(),
+        "instance_name": script_status_report.get("instance_name"),
+        "alias": alias,
+        **status,
+    }
+    try:
+        status_log.write(_dumps(line).decode('utf-8') + "\n")
+    except Exception as e:
+        print(f"Warning: could not write status log entry for {alias}: {str(e)}")
+
+# IMDSv2 token, requested once and reused for all metadata reads
+_imds_token = None
+
+def get_imds_token():
+    """Get an IMDSv2 token, requesting it only on first use"""
+    global _imds_token
+    if _imds_token is None:
+        response = http_request(
+            "PUT",
+            f"http://{IMDS_HOST}/latest/api/token",
+            headers={"X-aws-ec2-metadata-token-ttl-seconds": "60"},
+            timeout=IMDS_TIMEOUT,
+            retries=IMDS_RETRIES
+        )
+        _imds_token = response.data.decode('utf-8')
+    return _imds_token
+
 def get_instance_metadata(field, token):
     """Helper to get instance metadata with error handling"""
     try:
         headers = {"X-aws-ec2-metadata-token": token}
-        req = urllib.request.Request(
-            f"http://169.254.169.254/latest/meta-data/{field}",
-            headers=headers
+        response = http_request(
+            "GET",
+            f"http://{IMDS_HOST}/latest/meta-data/{field}",
+            headers=headers,
+            timeout=IMDS_TIMEOUT,
+            retries=IMDS_RETRIES
         )
-        with urllib.request.urlopen(req) as response:
-            return response.read().decode('utf-8')
+        return response.data.decode('utf-8')
     except:
         return "unknown" if field != "public-ipv4" else "N/A"
 
-def send_status_report():
+def send_status_report(webhook_url):
     """Send status report to webhook"""
-    webhook_url = args.webhook_url
     if not webhook_url:
         print("No webhook URL provided, skipping status report")
         return
@@ -100,18 +184,14 @@ def send_status_report():
     
     # Get IMDSv2 token
     try:
-        token_request = urllib.request.Request(
-            "http://169.254.169.254/latest/api/token",
-            headers={"X-aws-ec2-metadata-token-ttl-seconds": "60"},
-            method="PUT"
-        )
-        with urllib.request.urlopen(token_request) as response:
-            token = response.read().decode('utf-8')
+        token = get_imds_token()
         
-        # Get instance metadata
-        instance_id = get_instance_metadata("instance-id", token)
-        private_ip = get_instance_metadata("local-ipv4", token)
-        public_ip = get_instance_metadata("public-ipv4", token)
+        # Get instance metadata (fields are independent, so fetch them concurrently)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
+            instance_id, private_ip, public_ip = executor.map(
+                lambda field: get_instance_metadata(field, token),
+                ["instance-id", "local-ipv4", "public-ipv4"]
+            )
         
         # Add to final report
         final_report = script_status_report.copy()
@@ -120,57 +200,112 @@ def send_status_report():
         final_report["public_ip"] = public_ip
         
         # Send report
-        report_data = json.dumps(final_report).encode('utf-8')
-        req = urllib.request.Request(
+        report_data = _dumps(final_report)
+        response = http_request(
+            "POST",
             webhook_url,
-            data=report_data,
+            body=report_data,
             headers={"Content-Type": "application/json"},
-            method="POST"
+            timeout=WEBHOOK_TIMEOUT,
+            preload_content=False
         )
-        
-        with urllib.request.urlopen(req) as response:
-            print("Status report sent to webhook")
-            response_text = response.read().decode('utf-8')
-            print(response_text)
+        print("Status report sent to webhook")
+        # Only log the beginning of the webhook's reply
+        response_text = response.read(4096).decode('utf-8', errors='replace')
+        print(response_text)
+        response.drain_conn()
     
     except Exception as e:
         print(f"Error sending status report: {str(e)}")
 
-def download_repository(url):
-    """Download and parse the repository file"""
+def fetch_repository(url, aliases):
+    """Download and parse the repository file, then start resolving the requested scripts' hosts"""
+    # Doesn't log or touch the status report, so it can run in the background;
+    # returns the raw content and the parsed repository (None if not valid JSON)
+    SCRIPTS_DIR.mkdir(parents=True, exist_ok=True)
+    
+    # Stream the body straight to disk rather than buffering it as a str
+    with open_url(url) as response, \
+            open(SCRIPTS_DIR / "repository.json", "wb") as f:
+        shutil.copyfileobj(response, f, 65536)
+    
+    with open(SCRIPTS_DIR / "repository.json", "rb") as f:
+        content = f.read()
+    
     try:
-        with urllib.request.urlopen(url) as response:
-            content = response.read().decode('utf-8')
-            with open("/tmp/scripts/repository.json", "w") as f:
-                f.write(content)
-            
-            print("Successfully downloaded repository file.")
-            # Print first 100 chars to confirm content without bloating logs
-            print(f"Content preview: {content[:100]}...")
-            script_status_report["repository_status"] = "success"
-            
-            try:
-                return json.loads(content)
-            except json.JSONDecodeError:
-                print("Error: Repository content is not valid JSON")
-                script_status_report["repository_status"] = "failed"
-                return None
+        repository = json.loads(content)
+    except json.JSONDecodeError:
+        return content, None
+    
+    if isinstance(repository, dict):
+        # Convert GitHub URLs to raw URLs once, so aliases only need a lookup
+        # (done silently; each requested alias logs the URL it downloads from)
+        for alias, script_url in repository.items():
+            if isinstance(script_url, str) and "github.com" in script_url and "raw.githubusercontent.com" not in script_url:
+                repository[alias] = script_url.replace("github.com", "raw.githubusercontent.com").replace("/blob/", "/")
+        
+        preresolve_hosts(
+            script_url for script_url in map(repository.get, aliases)
+            if isinstance(script_url, str)
+        )
+    
+    return content, repository
+
+def download_repository(url, aliases, repository_future=None):
+    """Download and parse the repository file, or collect a fetch already started in the background"""
+    try:
+        if repository_future is None:
+            content, repository = fetch_repository(url, aliases)
+        else:
+            content, repository = repository_future.result()
+        
+        print("Successfully downloaded repository file.")
+        # Print first 100 chars to confirm content without bloating logs
+        print(f"Content preview: {content[:100].decode('utf-8', errors='replace')}...")
+        script_status_report["repository_status"] = "success"
+        
+        if repository is None:
+            print("Error: Repository content is not valid JSON")
+            script_status_report["repository_status"] = "failed"
+            return None
+        
+        return repository
     except Exception as e:
         print(f"Failed to download repository: {str(e)}")
         script_status_report["repository_status"] = "failed"
         return None
 
-def download_script(alias, script_url):
-    """Download a script from URL and return the file path"""
-    script_file = f"/tmp/scripts/{alias}.sh"
+def preresolve_hosts(urls):
+    """Start resolving the hosts of the given URLs in the background to warm the resolver cache"""
+    hosts = set()
+    for url in urls:
+        try:
+            parsed = urllib.parse.urlparse(url)
+            port = parsed.port or (443 if parsed.scheme == "https" else 80)
+        except ValueError:
+            # Malformed URLs are reported by the download itself
+            continue
+        if parsed.hostname:
+            hosts.add((parsed.hostname, port))
     
-    print(f"Downloading script to {os.path.basename(script_file)}")
-    try:
-        with urllib.request.urlopen(script_url) as response:
-            script_content = response.read().decode('utf-8')
-            
-            # Prepend parameter parsing helper
-            param_helper = """#!/bin/bash
+    if not hosts:
+        return
+    
+    def _resolve(host_port):
+        try:
+            socket.getaddrinfo(*host_port, type=socket.SOCK_STREAM)
+        except Exception:
+            # Best effort only; the download itself reports any failure
+            pass
+    
+    # Don't wait for the lookups: they only need a head start on the downloads
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=worker_count(len(hosts)))
+    for host_port in hosts:
+        executor.submit(_resolve, host_port)
+    executor.shutdown(wait=False)
+
+# Parameter parsing helper prepended to every downloaded script
+PARAM_HELPER = """#!/bin/bash
 # Parameter parsing helper
 parse_parameters() {
     # Initialize variables to default values
@@ -215,78 +350,79 @@ parse_parameters "$@"
 
 # Original script follows
 """
-            
-            # Add the helper and the original script content
-            with open(script_file, "w") as f:
-                # Check if the script already has a shebang line
-                if script_content.startswith("#!"):
-                    # Extract the shebang line
-                    shebang_line = script_content.split("\n")[0]
-                    rest_of_script = "\n".join(script_content.split("\n")[1:])
-                    # Combine shebang, helper, and rest of script
-                    param_helper_without_shebang = param_helper.split('\n', 1)[1]
-                    f.write(f"{shebang_line}\n{param_helper_without_shebang}{rest_of_script}")
-                else:
-                    # Use the complete helper with shebang
-                    f.write(f"{param_helper}{script_content}")
-            
-            # Make script executable
-            os.chmod(script_file, 0o755)
-            return script_file
-    except Exception as e:
-        print(f"Failed to download script: {str(e)}")
-        raise
+PARAM_HELPER_BYTES = PARAM_HELPER.encode('utf-8')
+PARAM_HELPER_NO_SHEBANG_BYTES = PARAM_HELPER.split('\n', 1)[1].encode('utf-8')
 
-def execute_script(alias, script_file, params_map):
-    """Execute a script with parameters and return results"""
+def download_script(alias, script_url):
+    """Download a script from URL and return the file path (doesn't log, so it can run in a worker thread)"""
+    script_file = script_path(alias, ".sh")
+    
+    with open_url(script_url) as response:
+        script_content = response.read()
+    
+    # Add the helper and the original script content (created executable)
+    with open(script_file, "wb", opener=_exec_opener) as f:
+        # Check if the script already has a shebang line
+        if script_content.startswith(b"#!"):
+            # Keep the script's own shebang, then the helper, then the rest of the script
+            shebang_line, _, rest_of_script = script_content.partition(b"\n")
+            f.write(shebang_line + b"\n" + PARAM_HELPER_NO_SHEBANG_BYTES + rest_of_script)
+        else:
+            # Use the complete helper with shebang
+            f.write(PARAM_HELPER_BYTES + script_content)
+    
+    return script_file
+
+def prepare_script_parameters(params_map):
+    """Build the environment variables and command-line arguments for a script's parameters"""
+    # Environment variables keep the original names (backward compatibility)
+    env = {param_name: str(param_value) for param_name, param_value in params_map.items()}
+    
+    # Named command-line arguments use kebab-case with an equals sign:
+    # --param-name=value (passed as-is, no shell quoting)
+    argv_suffix = [
+        f"--{param_name.lower().replace('_', '-')}={param_value}"
+        for param_name, param_value in params_map.items()
+    ]
+    
+    return env, argv_suffix
+
+def execute_script(alias, script_file, prepared_params):
+    """Execute a script with prepared parameters and return results"""
+    env, argv_suffix = prepared_params
+    
     # Extract parameters
     print(f"Setting up parameters for script {alias}")
-    param_args = ""
-    param_details = ""
+    for param_name, param_value in env.items():
+        print(f"Using parameter {param_name}={param_value}")
     
     # Set environment variables for parameters (for backward compatibility)
-    # And build named command-line arguments
-    for param_name, param_value in params_map.items():
-        print(f"Using parameter {param_name}={param_value}")
-        param_details += f"\n  - {param_name} = '{param_value}'"
-        
-        # Set as environment variable (backward compatibility)
-        os.environ[param_name] = str(param_value)
-        
-        # Convert parameter name to kebab-case for command line
-        # First to lowercase, then replace underscores with hyphens
-        param_name_kebab = param_name.lower().replace('_', '-')
-        
-        # Format with equals sign: --param-name="value"
-        param_args += f" --{param_name_kebab}=\"{param_value}\""
+    os.environ.update(env)
+    argv = [script_file, *argv_suffix]
     
     # Execute script
-    print(f"=== EXECUTING SCRIPT: {alias} at {datetime.datetime.utcnow().strftime('%H:%M:%S')} ===")
+    print(f"=== EXECUTING SCRIPT: {alias} at {time.strftime('%H:%M:%S', time.gmtime())} ===")
     
     # Capture script output
-    script_output_file = f"/tmp/scripts/{alias}_output.txt"
-    cmd = f"{script_file}{param_args}"
-    stdout, stderr, exit_code = run_command(cmd)
+    script_output_file = script_path(alias, "_output.txt")
+    stdout, stderr, exit_code = run_command(argv, shell=False)
+    
+    output = stdout
+    if stderr:
+        output += "\n\nSTDERR:\n" + stderr
     
     with open(script_output_file, "w") as f:
-        f.write(stdout)
-        if stderr:
-            f.write("\n\nSTDERR:\n")
-            f.write(stderr)
+        f.write(output)
     
     # Get script output (limited to first 20 lines)
-    with open(script_output_file, "r") as f:
-        script_output = "".join(f.readlines()[:20])
+    script_output = head_lines(output)
     
     print(f"=== SCRIPT {alias} COMPLETED (exit: {exit_code}) ===")
     
     return exit_code, script_output
 
-def download_and_execute_scripts():
-    """Download and execute scripts from repository"""
-    repository_url = args.scripts_repository_url
-    script_aliases = args.script_aliases
-    
+def download_and_execute_scripts(repository_url, script_aliases, script_parameters_json, repository_future=None):
+    """Download and execute scripts from repository (repository_future: a fetch_repository call already in flight)"""
     if not repository_url:
         print("No scripts repository URL provided, skipping script downloads")
         return
@@ -299,149 +435,267 @@ def download_and_execute_scripts():
     print(f"Starting script execution with repository: '{repository_url}' and aliases: '{script_aliases}'")
     print(f"Downloading scripts repository from {repository_url}")
     
-    # Create scripts directory
-    os.makedirs("/tmp/scripts", exist_ok=True)
+    # Process script aliases
+    aliases = script_aliases.split()
     
     # Download repository file
     print("Downloading repository...")
-    repository = download_repository(repository_url)
+    repository = download_repository(repository_url, aliases, repository_future)
     if not repository:
         return
     
     # Parse script parameters
-    script_parameters_json = args.script_parameters
     try:
         script_parameters = json.loads(script_parameters_json)
     except json.JSONDecodeError:
         print("Warning: Script parameters is not valid JSON, using empty dict")
         script_parameters = {}
     
-    # Process script aliases
-    aliases = script_aliases.split()
+    if not isinstance(script_parameters, dict):
+        print("Warning: Script parameters is not a JSON object, using empty dict")
+        script_parameters = {}
     
-    for alias in aliases:
-        print(f"Processing script alias: {alias}")
-        
-        # Initialize script status
-        script_status = "pending"
-        start_time = datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
+    # Normalize parameters once so the per-alias path only applies them;
+    # malformed entries are kept as None and reported as errors for that alias
+    prepared_parameters = {}
+    for alias, params_map in script_parameters.items():
+        if isinstance(params_map, dict):
+            prepared_parameters[alias] = prepare_script_parameters(params_map)
+        else:
+            print(f"Warning: Parameters for alias {alias} are not a JSON object")
+            prepared_parameters[alias] = None
+    
+    def _download_one(alias):
+        """Download the script for an alias; logging is left to the main thread"""
+        script_url = repository.get(alias)
+        if not script_url:
+            raise ValueError("No URL found for alias")
+        return download_script(alias, script_url)
+    
+    # Downloads overlap in worker threads; scripts are executed (and the
+    # status report updated) on the main thread in the order the aliases were
+    # given, since later scripts may depend on earlier ones
+    with concurrent.futures.ThreadPoolExecutor(max_workers=worker_count(len(aliases))) as executor:
+        # Each script file is downloaded only once, so no worker rewrites a
+        # file that an earlier alias is still executing
+        downloads = {}
+        futures = []
+        for alias in aliases:
+            script_file = script_path(alias, ".sh")
+            if script_file not in downloads:
+                downloads[script_file] = (alias, executor.submit(_download_one, alias))
+            futures.append(downloads[script_file])
         
-        try:
-            # Find URL for this alias
-            script_url = repository.get(alias)
+        for alias, (download_alias, future) in zip(aliases, futures):
+            print(f"Processing script alias: {alias}")
             
-            # Convert GitHub URLs to raw URLs if needed
-            if script_url and "github.com" in script_url and "raw.githubusercontent.com" not in script_url:
-                print(f"Converting GitHub URL: {script_url.split('/')[-1]}")
-                script_url = script_url.replace("github.com", "raw.githubusercontent.com").replace("/blob/", "/")
+            # Timed from here so earlier scripts' run time isn't included
+            start_time = utcnow_iso()
             
-            if not script_url:
-                print(f"Warning: No URL found for alias {alias}")
+            try:
+                # Find URL for this alias
+                script_url = repository.get(alias)
+                if not script_url:
+                    print(f"Warning: No URL found for alias {alias}")
+                    raise ValueError("No URL found for alias")
+                
+                if repository.get(download_alias) != script_url:
+                    raise ValueError(f"Script file name clashes with alias {download_alias}")
+                
+                # Download script (already running in the pool)
+                print(f"Downloading script from {script_url}")
+                print(f"Downloading script to {script_path(alias, '.sh').name}")
+                try:
+                    script_file = future.result()
+                except Exception as e:
+                    print(f"Failed to download script: {str(e)}")
+                    raise
+                
+                # Get parameters for this script
+                prepared_params = prepared_parameters.get(alias, ({}, []))
+                if prepared_params is None:
+                    raise ValueError("Script parameters are not a JSON object")
+                
+                # Execute script
+                exit_code, script_output = execute_script(alias, script_file, prepared_params)
+                end_time = utcnow_iso()
+                
+                if exit_code == 0:
+                    script_status = "success"
+                    print(f"Script {alias} completed successfully")
+                else:
+                    script_status = "failed"
+                    print(f"Script {alias} failed with exit code {exit_code}")
+                
+                # Update status report
+                record_script_status(alias, {
+                    "status": script_status,
+                    "exit_code": exit_code,
+                    "output": script_output,
+                    "start_time": start_time,
+                    "end_time": end_time
+                })
+                
+            except Exception as e:
+                print(f"Failed to process script {alias}: {str(e)}")
                 script_status = "error"
-                error_message = "No URL found for alias"
-                script_status_report["scripts"][alias] = {
+                error_message = str(e)
+                record_script_status(alias, {
                     "status": script_status,
                     "error": error_message,
                     "start_time": start_time,
-                    "end_time": datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
-                }
-                continue
-            
-            # Download script
-            print(f"Downloading script from {script_url}")
-            script_file = download_script(alias, script_url)
-            
-            # Get parameters for this script
-            script_params_map = script_parameters.get(alias, {})
-            
-            # Execute script
-            exit_code, script_output = execute_script(alias, script_file, script_params_map)
-            end_time = datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
-            
-            if exit_code == 0:
-                script_status = "success"
-                print(f"Script {alias} completed successfully")
-            else:
-                script_status = "failed"
-                print(f"Script {alias} failed with exit code {exit_code}")
-            
-            # Update status report
-            script_status_report["scripts"][alias] = {
-                "status": script_status,
-                "exit_code": exit_code,
-                "output": script_output,
-                "start_time": start_time,
-                "end_time": end_time
-            }
-            
-        except Exception as e:
-            print(f"Failed to process script {alias}: {str(e)}")
-            script_status = "error"
-            error_message = str(e)
-            script_status_report["scripts"][alias] = {
-                "status": script_status,
-                "error": error_message,
-                "start_time": start_time,
-                "end_time": datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
-            }
-
-# Download and execute scripts
-if args.scripts_repository_url and args.script_aliases:
-    download_and_execute_scripts()
-else:
-    print("Skipping script download and execution because:")
-    if not args.scripts_repository_url:
-        print("  - scripts_repository_url is empty")
-    if not args.script_aliases:
-        print("  - script_aliases is empty")
-
-# Run custom init script if provided
-init_script_content = args.init_script
-init_script_status = "not_executed"
-
-if init_script_content.strip():
-    print("Running custom initialization script...")
-    with open("/tmp/custom_init.sh", "w") as f:
-        f.write(init_script_content)
-    
-    os.chmod("/tmp/custom_init.sh", 0o755)
-    
-    init_start_time = datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
-    stdout, stderr, init_exit_code = run_command("/tmp/custom_init.sh")
-    init_end_time = datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
-    
-    with open("/tmp/init_script_output.txt", "w") as f:
-        f.write(stdout)
-        if stderr:
-            f.write("\n\nSTDERR:\n")
-            f.write(stderr)
+                    "end_time": utcnow_iso()
+                })
+
+def main():
+    """Entry point: set up logging, install packages, run scripts and report status"""
+    global script_status_report, status_log
     
-    if init_exit_code == 0:
-        init_script_status = "success"
-    else:
-        init_script_status = "failed"
+    import argparse
+    
+    # Set up argument parser
+    parser = argparse.ArgumentParser(description='EC2 User Data Script')
+    parser.add_argument('--instance-name', required=True, help='Name of the EC2 instance')
+    parser.add_argument('--environment', required=True, help='Environment tag')
+    parser.add_argument('--scripts-repository-url', required=False, default='', help='URL to scripts repository')
+    parser.add_argument('--script-aliases', required=False, default='', help='Space-separated list of script aliases')
+    parser.add_argument('--script-parameters', required=False, default='{}', help='JSON map of script parameters')
+    parser.add_argument('--webhook-url', required=False, default='', help='Webhook URL for notifications')
+    parser.add_argument('--init-script', required=False, default='', help='Custom initialization script')
+
+    # Parse arguments
+    args = parser.parse_args()
+
+    # Set up logging to append to the same file, at the fd level so that
+    # child processes which don't capture their output also write there
+    log_fd = os.open('/var/log/user-data.log', os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    os.dup2(log_fd, 1)
+    os.dup2(log_fd, 2)
+    os.close(log_fd)
+    sys.stdout = os.fdopen(1, 'w', buffering=1)
+    sys.stderr = os.fdopen(2, 'w', buffering=1)
+
+    # Line-buffered NDJSON log of per-script results, so progress survives a crash
+    try:
+        status_log = open('/var/log/user-data-status.ndjson', 'a', buffering=1)
+    except OSError as e:
+        print(f"Warning: could not open status log: {str(e)}")
+
+    print("\n\n===== PYTHON SCRIPT STARTED =====\n")
     
-    with open("/tmp/init_script_output.txt", "r") as f:
-        init_output = "".join(f.readlines()[:20])
+    # Fetch the scripts repository and warm DNS for the requested scripts'
+    # hosts in the background while apt runs; neither needs the packages
+    repository_future = None
+    if args.scripts_repository_url and args.script_aliases:
+        background = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        repository_future = background.submit(
+            fetch_repository, args.scripts_repository_url, args.script_aliases.split()
+        )
+        background.shutdown(wait=False)
     
-    script_status_report["init_script"] = {
-        "status": init_script_status,
-        "exit_code": init_exit_code,
-        "output": init_output,
-        "start_time": init_start_time,
-        "end_time": init_end_time
+    # Update system and install required packages in one non-interactive apt run,
+    # retrying with backoff instead of reinstalling packages one by one
+    print("Updating system and installing required packages...")
+    apt_env = "DEBIAN_FRONTEND=noninteractive"
+    for attempt in range(3):
+        _, _, exit_code = run_command(
+            f"{apt_env} apt-get -qq update && "
+            f"{apt_env} apt-get -qq install -y --no-install-recommends openssh-client curl wget jq",
+            capture=False
+        )
+        if exit_code == 0:
+            print("Package installation completed")
+            break
+        if attempt < 2:
+            print(f"Package installation failed (exit: {exit_code}), retrying...")
+            time.sleep(2 ** attempt)
+    else:
+        print(f"Package installation failed after 3 attempts (exit: {exit_code})")
+
+    # Verify jq is installed
+    _, _, exit_code = run_command("which jq", capture=False)
+    if exit_code != 0:
+        print("ERROR: Failed to install jq. Exiting.")
+        sys.exit(1)
+
+    print("jq is installed and available")
+
+    # Initialize status report
+    timestamp = utcnow_iso()
+    instance_name = args.instance_name
+    script_status_report = {
+        "timestamp": timestamp,
+        "instance_name": instance_name,
+        "scripts": {}
     }
+    
+    # Download and execute scripts
+    if args.scripts_repository_url and args.script_aliases:
+        download_and_execute_scripts(
+            args.scripts_repository_url, args.script_aliases, args.script_parameters, repository_future
+        )
+    else:
+        print("Skipping script download and execution because:")
+        if not args.scripts_repository_url:
+            print("  - scripts_repository_url is empty")
+        if not args.script_aliases:
+            print("  - script_aliases is empty")
+
+    # Run custom init script if provided
+    init_script_content = args.init_script
+    init_script_status = "not_executed"
+
+    if init_script_content.strip():
+        print("Running custom initialization script...")
+        with open("/tmp/custom_init.sh", "w", opener=_exec_opener) as f:
+            f.write(init_script_content)
+        
+        init_start_time = utcnow_iso()
+        stdout, stderr, init_exit_code = run_command("/tmp/custom_init.sh")
+        init_end_time = utcnow_iso()
+        
+        init_output = stdout
+        if stderr:
+            init_output += "\n\nSTDERR:\n" + stderr
+        
+        with open("/tmp/init_script_output.txt", "w") as f:
+            f.write(init_output)
+        
+        if init_exit_code == 0:
+            init_script_status = "success"
+        else:
+            init_script_status = "failed"
+        
+        init_output = head_lines(init_output)
+        
+        script_status_report["init_script"] = {
+            "status": init_script_status,
+            "exit_code": init_exit_code,
+            "output": init_output,
+            "start_time": init_start_time,
+            "end_time": init_end_time
+        }
 
-# Signal completion
-with open("/tmp/user_data_complete", "w") as f:
-    f.write("")
+    # Signal completion
+    with open("/tmp/user_data_complete", "w") as f:
+        f.write("")
 
-# Send final status report
-if args.webhook_url:
-    send_status_report()
+    # Send final status report
+    if args.webhook_url:
+        send_status_report(args.webhook_url)
 
-# Print a completion message
-print("\n===== PYTHON SCRIPT COMPLETED =====\n")
+    # Print a completion message
+    print("\n===== PYTHON SCRIPT COMPLETED =====\n")
+
+    # Sync the status log to disk once, then close it and flush the main log
+    if status_log is not None:
+        try:
+            status_log.flush()
+            os.fsync(status_log.fileno())
+            status_log.close()
+        except OSError as e:
+            print(f"Warning: could not sync status log: {str(e)}")
+    sys.stdout.flush()
 
-# Close log file
-log_file.close()
+if __name__ == "__main__":
+    main()